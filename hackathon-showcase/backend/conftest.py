@@ -0,0 +1,74 @@
+"""
+Test setup for the Gemini integration examples.
+
+InputGuard, the prompt builders and the cache helpers are pure Python, so
+their tests must not need the Vertex AI SDK or Redis installed. When those
+packages are missing, register minimal stand-ins for the names
+gemini_integration_example imports at module level; anything that would
+actually call Vertex is monkeypatched by the tests themselves.
+"""
+
+import importlib.util
+import sys
+import types
+
+
+def _missing(name: str) -> bool:
+    try:
+        return importlib.util.find_spec(name) is None
+    except ModuleNotFoundError:
+        return True
+
+
+def _stub_module(name: str, **attrs) -> None:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+
+
+class _StubSDKObject:
+    def __init__(self, *args, **kwargs):
+        raise RuntimeError("Vertex AI SDK is not installed")
+
+    from_data = from_uri = from_text = classmethod(__init__)
+
+
+if _missing("vertexai"):
+    _stub_module("vertexai", init=lambda **kwargs: None)
+    _stub_module(
+        "vertexai.generative_models",
+        GenerativeModel=_StubSDKObject,
+        Part=_StubSDKObject,
+    )
+
+if _missing("google.api_core"):
+    class GoogleAPICallError(Exception):
+        pass
+
+    class ResourceExhausted(GoogleAPICallError):
+        pass
+
+    class InvalidArgument(GoogleAPICallError):
+        pass
+
+    if _missing("google"):
+        _stub_module("google")
+    else:
+        importlib.import_module("google")
+    _stub_module("google.api_core")
+    _stub_module(
+        "google.api_core.exceptions",
+        GoogleAPICallError=GoogleAPICallError,
+        ResourceExhausted=ResourceExhausted,
+        InvalidArgument=InvalidArgument,
+    )
+
+if _missing("redis"):
+    class RedisError(Exception):
+        pass
+
+    _stub_module("redis")
+    _stub_module("redis.exceptions", RedisError=RedisError)
@@ -0,0 +1,205 @@
+import asyncio
+import random
+import re
+import sys
+import types
+
+import pytest
+from redis.exceptions import RedisError
+
+import gemini_integration_example as gemini
+from gemini_integration_example import InputGuard, build_daily_briefing_prompt
+
+
+def _baseline_clean_input(text):
+    if not text:
+        return ""
+    return re.sub(r'<[^>]*>', '', text).strip()
+
+
+def _baseline_mask_pii(text):
+    if not text:
+        return ""
+    text = re.sub(r'[\w\.-]+@[\w\.-]+', '[EMAIL_MASKED]', text)
+    return re.sub(r'\b\d{8,15}\b', '[PHONE_MASKED]', text)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("foo<b>@bar.com", "[EMAIL_MASKED]"),
+    ("call 1234<x>5678 now", "call [PHONE_MASKED] now"),
+    (" <b>call</b> 0123456789 or x@y.com ", "call [PHONE_MASKED] or [EMAIL_MASKED]"),
+    ("Beauty Salon", "Beauty Salon"),
+    ("", ""),
+])
+def test_sanitize_masks_pii_split_by_tags(text, expected):
+    assert InputGuard.sanitize(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "foo<b>@bar.com",
+    "call 1234<x>5678 now",
+    "<i>a.b</i>@c.d 98765<br/>4321",
+    " plain text ",
+])
+def test_sanitize_matches_clean_then_mask(text):
+    assert InputGuard.sanitize(text) == InputGuard.mask_pii(InputGuard.clean_input(text))
+
+
+def test_guard_matches_baseline_patterns():
+    # The fused, prefiltered regexes must behave exactly like the original
+    # two-pass patterns; the alphabet is dense in the characters they key on
+    rng = random.Random(1234)
+    alphabet = "ab_.-@<>/ 0123456789\n"
+    for _ in range(20000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        assert InputGuard.clean_input(text) == _baseline_clean_input(text), text
+        assert InputGuard.mask_pii(text) == _baseline_mask_pii(text), text
+        assert InputGuard.sanitize(text) == _baseline_mask_pii(_baseline_clean_input(text)), text
+
+
+def test_briefing_accepts_unhashable_global_context():
+    prompt = build_daily_briefing_prompt(
+        {"industry": "Beauty Salon", "user_country": "MY", "data": {}},
+        "2025-11-15",
+        {},
+        {"leader_country": "SG", "top_service": ["Facial", "Massage"]},
+    )
+    assert "Top Trending Service: \"['Facial', 'Massage']\"" in prompt
+
+
+class FakeRedis:
+    def __init__(self, fail=False):
+        self.store = {}
+        self.ttls = {}
+        self.fail = fail
+
+    async def get(self, key):
+        if self.fail:
+            raise RedisError("down")
+        return self.store.get(key)
+
+    async def setex(self, key, ttl, value):
+        if self.fail:
+            raise RedisError("down")
+        self.store[key] = value
+        self.ttls[key] = ttl
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis()
+    monkeypatch.setattr(gemini, "_redis", lambda: client)
+    return client
+
+
+def _counting_cached(result):
+    calls = []
+
+    @gemini.cache_json_response(lambda arg: f"test:{arg}", ttl=60)
+    async def compute(arg):
+        calls.append(arg)
+        return result
+
+    return compute, calls
+
+
+def test_response_cache_miss_then_hit(fake_redis):
+    compute, calls = _counting_cached({"a": 1})
+    assert asyncio.run(compute("x")) == {"a": 1}
+    assert asyncio.run(compute("x")) == {"a": 1}
+    assert calls == ["x"]
+    assert fake_redis.ttls == {"test:x": 60}
+
+
+def test_response_cache_redis_error_degrades_to_uncached_call(fake_redis):
+    fake_redis.fail = True
+    compute, calls = _counting_cached({"a": 1})
+    assert asyncio.run(compute("x")) == {"a": 1}
+    assert asyncio.run(compute("x")) == {"a": 1}
+    assert calls == ["x", "x"]
+
+
+def test_response_cache_skips_unserializable_result(fake_redis):
+    compute, calls = _counting_cached({"n": 2 ** 64})
+    assert asyncio.run(compute("x")) == {"n": 2 ** 64}
+    assert calls == ["x"]
+    assert fake_redis.store == {}
+
+
+def test_response_cache_unreadable_entry_is_a_miss(fake_redis):
+    fake_redis.store["test:x"] = b"not json"
+    compute, calls = _counting_cached({"a": 1})
+    assert asyncio.run(compute("x")) == {"a": 1}
+    assert calls == ["x"]
+    assert fake_redis.store["test:x"] == b'{"a":1}'
+
+
+class FakeBatchJob:
+    name = "jobs/1"
+    has_ended = True
+    has_succeeded = True
+    output_location = "gs://bucket/run/output"
+
+    @classmethod
+    def submit(cls, **kwargs):
+        return cls()
+
+
+def _batch_line(idx, text=None, status=None, candidates=True):
+    line = {"request": {"labels": {"briefing_idx": str(idx)}}}
+    if status:
+        line["status"] = status
+    elif candidates:
+        line["response"] = {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+    else:
+        line["response"] = {"candidates": []}
+    return line
+
+
+@pytest.fixture
+def batch_output(monkeypatch):
+    lines = []
+    monkeypatch.setitem(
+        sys.modules, "vertexai.batch_prediction",
+        types.SimpleNamespace(BatchPredictionJob=FakeBatchJob),
+    )
+    monkeypatch.setattr(gemini, "_init_vertex", lambda: None)
+    monkeypatch.setattr(gemini, "_upload_blob", lambda *args: None)
+    monkeypatch.setattr(gemini, "_read_batch_output", lambda location: lines)
+    return lines
+
+
+def test_batch_maps_output_lines_to_tenants(batch_output, fake_redis):
+    prompts = {"t0": ["p0"], "t1": ["p1"], "t2": ["p2"], "t3": ["p3"], "t4": ["p4"]}
+    batch_output.extend([
+        _batch_line(3, text='{"day": 3}'),  # out of order
+        {"request": {}},  # unlabelled
+        _batch_line(99, text="{}"),  # label out of range
+        _batch_line(0, text='```json\n{"day": 0}\n```'),
+        _batch_line(1, status="RESOURCE_EXHAUSTED"),
+        _batch_line(2, candidates=False),
+    ])
+    results = asyncio.run(gemini.run_daily_briefing_batch(prompts, "gs://bucket/run"))
+
+    assert results["t0"] == {"day": 0}
+    assert results["t3"] == {"day": 3}
+    assert isinstance(results["t1"], RuntimeError)
+    assert "RESOURCE_EXHAUSTED" in str(results["t1"])
+    assert isinstance(results["t2"], IndexError)
+    assert str(results["t4"]) == "No batch output for tenant"
+    assert sorted(fake_redis.ttls.values()) == [gemini.BRIEFING_CACHE_TTL] * 2
+
+
+def test_batch_cache_write_failures_keep_results(batch_output, fake_redis, monkeypatch):
+    async def flaky_setex(key, ttl, value):
+        raise ConnectionError("reset")
+
+    monkeypatch.setattr(fake_redis, "setex", flaky_setex)
+    prompts = {"t0": ["p0"], "t1": ["p1"]}
+    batch_output.extend([
+        _batch_line(0, text='{"n": 18446744073709551616}'),  # beyond orjson's range
+        _batch_line(1, text='{"n": 1}'),
+    ])
+    results = asyncio.run(gemini.run_daily_briefing_batch(prompts, "gs://bucket/run"))
+
+    assert results == {"t0": {"n": 2 ** 64}, "t1": {"n": 1}}